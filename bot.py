@@ -1,18 +1,44 @@
 import discord
 from discord import app_commands
-import subprocess
+import asyncio
 import os
 import logging
-import requests
+import aiohttp
+import fnmatch
+import json
+import re
 import socket
+import time
 from datetime import datetime, timezone
+from urllib.parse import quote
 
 # --- CONFIG ---
 TOKEN = os.getenv("DISCORD_TOKEN")
-ALLOWED_ROLE = int(os.getenv("ALLOWED_ROLE", "0"))
+# One or more role IDs, comma-separated
+ALLOWED_ROLES = frozenset(
+    int(role) for role in os.getenv("ALLOWED_ROLE", "").split(",") if role.strip()
+)
 WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")
 HOSTNAME = os.getenv("HOSTNAME", socket.gethostname())
 ENABLE_AAF = os.getenv("ENABLE_AAF_RENAME", "false").lower() == "true"
+DOCKER_SOCKET = os.getenv("DOCKER_SOCKET", "/var/run/docker.sock")
+CONTAINER_CACHE_TTL = 2.0  # seconds; autocomplete fires on every keystroke
+CONTAINER_FILTER = os.getenv("CONTAINER_FILTER", "").strip()
+WEBHOOK_BATCH_DELAY = 0.5  # seconds to let a burst of actions accumulate
+WEBHOOK_MAX_EMBEDS = 10    # Discord's per-message embed limit
+MESSAGE_CHUNK_SIZE = 1900  # stay under Discord's 2000-char message limit
+MAX_SCRIPT_WORKERS = 4     # concurrent pre_restart.sh runs
+DOCKER_TIMEOUT = 30        # seconds for container listings; actions wait on the container's own stop timeout
+SCRIPT_TIMEOUT = 30        # seconds for pre_restart.sh
+WEBHOOK_TIMEOUT = aiohttp.ClientTimeout(sock_connect=2, sock_read=5)
+WEBHOOK_DRAIN_TIMEOUT = 10  # seconds to flush queued webhooks on shutdown
+
+# Base webhook embed colors
+ACTION_COLORS = {
+    "start": 0x00FF00,   # 🟢
+    "restart": 0xFFFF00, # 🟡
+    "stop": 0xFF0000     # 🔴
+}
 
 # --- LOGGING ---
 logging.basicConfig(level=logging.INFO)
@@ -20,91 +46,179 @@ logger = logging.getLogger("docker_discord_bot")
 
 # --- DISCORD CLIENT ---
 intents = discord.Intents.default()
-bot = discord.Client(intents=intents)
+
+class DockerBot(discord.Client):
+    async def setup_hook(self):
+        """Open shared sessions and start background tasks before connecting to the gateway."""
+        global _http, _docker, _webhook_task
+        _http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, limit_per_host=10),
+            timeout=WEBHOOK_TIMEOUT,
+        )
+        _docker = aiohttp.ClientSession(
+            connector=aiohttp.UnixConnector(path=DOCKER_SOCKET),
+            timeout=aiohttp.ClientTimeout(),  # per-call limits are set in docker_api
+        )
+        _webhook_task = asyncio.create_task(_webhook_flusher())
+
+    async def close(self):
+        if _webhook_task and not _webhook_task.done():
+            # 👇 let the flusher send what's still queued before the session closes
+            _webhook_queue.put_nowait(None)
+            try:
+                await asyncio.wait_for(_webhook_task, timeout=WEBHOOK_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                dropped = 0
+                while not _webhook_queue.empty():
+                    dropped += _webhook_queue.get_nowait() is not None
+                logger.warning(f"Webhook flush timed out on shutdown; dropped {dropped} queued embed(s)")
+        if _http:
+            await _http.close()
+        if _docker:
+            await _docker.close()
+        await super().close()
+
+bot = DockerBot(intents=intents)
 tree = app_commands.CommandTree(bot)
 
-# --- UTILITY FUNCTIONS ---
-def run_docker_cmd(cmd):
-    """Run docker CLI commands and return stdout."""
-    result = subprocess.run(["docker"] + cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise RuntimeError(result.stderr.strip())
-    return result.stdout.strip()
+# Shared HTTP session (created in setup_hook) so webhook POSTs reuse pooled connections
+_http: aiohttp.ClientSession | None = None
+
+# Docker Engine API session over the mounted Unix socket (created in setup_hook)
+_docker: aiohttp.ClientSession | None = None
 
-import fnmatch  # add this import near the top of bot.py
+# Webhook embeds waiting to be flushed in batches by _webhook_flusher
+_webhook_queue: asyncio.Queue = asyncio.Queue()
+_webhook_task: asyncio.Task | None = None
 
-def get_containers(only_running=False, only_stopped=False):
+# Caps concurrent pre-restart scripts so a burst of commands can't fork without limit
+_script_slots = asyncio.Semaphore(MAX_SCRIPT_WORKERS)
+
+# --- UTILITY FUNCTIONS ---
+async def docker_api(method, path, timeout=None, **params):
+    """Call the Docker Engine API over the Unix socket and return the decoded JSON body.
+
+    `timeout` caps the whole call in seconds; None waits as long as the engine needs.
+    """
+    try:
+        async with _docker.request(
+            method, f"http://localhost{path}", params=params,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as resp:
+            body = await resp.read()
+    except asyncio.TimeoutError:
+        raise RuntimeError(f"Docker API did not respond within {timeout}s")
+    if resp.status >= 400:
+        try:
+            message = json.loads(body)["message"]
+        except (ValueError, KeyError, TypeError):
+            message = body.decode().strip() or resp.reason
+        raise RuntimeError(message)
+    return json.loads(body) if body else None
+
+async def container_action(container, action):
+    """Start, stop or restart a container by name.
+
+    Not time-capped: stop/restart honour the container's StopTimeout, which
+    game servers often set well above DOCKER_TIMEOUT.
+    """
+    await docker_api("POST", f"/containers/{quote(container, safe='')}/{action}")
+
+# CONTAINER_FILTER glob (*fs25*, fs25*, *fs25) compiled once; None when it matches everything
+_FILTER_RE = (
+    re.compile(fnmatch.translate(CONTAINER_FILTER))
+    if CONTAINER_FILTER not in ("", "*") else None
+)
+
+# (only_running, only_stopped) -> (timestamp, containers)
+_container_cache: dict[tuple[bool, bool], tuple[float, list]] = {}
+
+def invalidate_container_cache():
+    """Drop cached container lists so the next lookup reflects a state change."""
+    _container_cache.clear()
+
+async def get_containers(only_running=False, only_stopped=False):
     """Return a list of (name, status) tuples, filtered by CONTAINER_FILTER (supports wildcards)."""
-    cmd = ["ps", "-a", "--format", "{{.Names}}|{{.Status}}"]
+    key = (only_running, only_stopped)
+    cached = _container_cache.get(key)
+    if cached and time.monotonic() - cached[0] < CONTAINER_CACHE_TTL:
+        return cached[1]
+
+    # Let the engine do the state filtering instead of parsing every container here
+    params = {"all": "1"}
     if only_running:
-        cmd = ["ps", "--format", "{{.Names}}|{{.Status}}"]
+        # no "all" and no status filter: the engine's default set, same as plain docker ps
+        # (running, paused and restarting containers)
+        params = {}
+    elif only_stopped:
+        params["filters"] = json.dumps({"status": ["exited", "created"]})
 
-    container_filter = os.getenv("CONTAINER_FILTER", "").strip()
     try:
-        output = run_docker_cmd(cmd)
         containers = []
-        for line in output.splitlines():
-            if "|" in line:
-                name, status = line.split("|", 1)
-                name, status = name.strip(), status.strip()
-                if only_stopped and status.lower().startswith("up"):
-                    continue
-
-                # ✅ Apply filter with wildcard support (*fs25*, fs25*, *fs25)
-                if container_filter and container_filter != "*":
-                    if not fnmatch.fnmatch(name, container_filter):
-                        continue
-
-                containers.append((name, status))
+        for entry in await docker_api("GET", "/containers/json", timeout=DOCKER_TIMEOUT, **params):
+            name, status = entry["Names"][0].lstrip("/"), entry["Status"]
+
+            # ✅ Apply filter with wildcard support (*fs25*, fs25*, *fs25)
+            if _FILTER_RE and not _FILTER_RE.match(name):
+                continue
+
+            containers.append((name, status))
+        _container_cache[key] = (time.monotonic(), containers)
         return containers
     except Exception as e:
         logger.error(f"Error fetching containers: {e}")
         return []
 
-def call_external_script(container):
+async def call_external_script(container):
     """Optionally run AAF rename script before restart and capture output."""
-    if os.getenv("ENABLE_AAF_RENAME", "false").lower() != "true":
+    if not ENABLE_AAF:
         logger.info("AAF rename disabled in .env")
         return None, None
 
+    proc = None
     try:
-        result = subprocess.run(
-            ["/app/scripts/pre_restart.sh", container],
-            capture_output=True,   # 👈 REQUIRED to capture stdout
-            text=True              # 👈 converts bytes to string
-        )
-        logger.info(result.stdout)  # log everything from the script
-
-        nbspaces, gameline = None, None
-        for line in result.stdout.splitlines():
-            if line.startswith("WEBHOOK_NBSPS_WRITTEN:"):
-                nbspaces = line.split(":", 1)[1].strip()
-            if line.startswith("WEBHOOK_GAME_LINE:"):
-                gameline = line.split(":", 1)[1].strip()
+        async with _script_slots, asyncio.timeout(SCRIPT_TIMEOUT):
+            proc = await asyncio.create_subprocess_exec(
+                "/app/scripts/pre_restart.sh", container,
+                stdout=asyncio.subprocess.PIPE,   # 👈 REQUIRED to capture stdout
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+
+            # 👇 handle output line by line as the script prints it
+            nbspaces, gameline = None, None
+            async for raw in proc.stdout:
+                line = raw.decode(errors="replace").rstrip("\n")
+                logger.info(line)  # log everything from the script
+                if line.startswith("WEBHOOK_NBSPS_WRITTEN:"):
+                    nbspaces = line.split(":", 1)[1].strip()
+                if line.startswith("WEBHOOK_GAME_LINE:"):
+                    gameline = line.split(":", 1)[1].strip()
+            await proc.wait()
 
         return nbspaces, gameline
+    except TimeoutError:
+        logger.warning(f"AAF rename script timed out after {SCRIPT_TIMEOUT}s for {container}")
+        return None, None
     except Exception as e:
         logger.warning(f"AAF rename script failed for {container}: {e}")
         return None, None
-
-def send_webhook(user, container_name, action, nbspaces=None, gameline=None):
-    """Send a Discord webhook notification for container actions."""
+    finally:
+        # 👇 never leave the script running with an unread stdout pipe
+        if proc and proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+async def send_webhook(user, container_name, action, nbspaces=None, gameline=None):
+    """Queue a Discord webhook notification for container actions."""
     if not WEBHOOK_URL:
         logger.warning("Webhook URL not set, skipping notification.")
         return
 
-    # Base colors
-    colors = {
-        "start": 0x00FF00,   # 🟢
-        "restart": 0xFFFF00, # 🟡
-        "stop": 0xFF0000     # 🔴
-    }
-
     # Turn green if AAF rename succeeded
     if action == "restart" and nbspaces and ENABLE_AAF:
         color = 0x00FF00
     else:
-        color = colors.get(action, 0x808080)
+        color = ACTION_COLORS.get(action, 0x808080)
 
     # Embed fields
     fields = [
@@ -126,17 +240,56 @@ def send_webhook(user, container_name, action, nbspaces=None, gameline=None):
         "footer": {"text": "Docker Discord Bot"},
     }
 
-    try:
-        requests.post(WEBHOOK_URL, json={"embeds": [embed]})
-        logger.info(f"Sent webhook: {action} on {container_name} by {user}")
-    except Exception as e:
-        logger.error(f"Failed to send webhook: {e}")
+    await _webhook_queue.put(embed)
+    logger.info(f"Queued webhook: {action} on {container_name} by {user}")
+
+async def _webhook_flusher():
+    """Drain queued embeds and POST them up to WEBHOOK_MAX_EMBEDS per request.
+
+    A None in the queue (queued by close) flushes everything before it and stops.
+    """
+    stopping = False
+    while not stopping:
+        embed = await _webhook_queue.get()
+        if embed is None:
+            return
+        embeds = [embed]
+        await asyncio.sleep(WEBHOOK_BATCH_DELAY)
+        while len(embeds) < WEBHOOK_MAX_EMBEDS and not _webhook_queue.empty():
+            embed = _webhook_queue.get_nowait()
+            if embed is None:
+                stopping = True
+                break
+            embeds.append(embed)
+
+        try:
+            async with _http.post(WEBHOOK_URL, json={"embeds": embeds}) as resp:
+                resp.raise_for_status()
+            logger.info(f"Sent webhook with {len(embeds)} embed(s)")
+        except Exception as e:
+            logger.error(f"Failed to send webhook: {e}")
+
+def chunk_lines(lines, limit=MESSAGE_CHUNK_SIZE):
+    """Join lines into newline-separated chunks of at most `limit` characters."""
+    chunks, current, size = [], [], 0
+    for line in lines:
+        if current and size + 1 + len(line) > limit:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        size += len(line) + (1 if current else 0)
+        current.append(line)
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
 
 def is_authorized(interaction: discord.Interaction):
-    """Check if user has allowed role or is admin."""
-    if interaction.user.guild_permissions.administrator:
+    """Check if user has an allowed role or is admin."""
+    # Discord sends the member's resolved permissions with the interaction,
+    # so this avoids recomputing guild_permissions from every role
+    perms = interaction.permissions
+    if perms.administrator:
         return True
-    return any(role.id == ALLOWED_ROLE for role in interaction.user.roles)
+    return not ALLOWED_ROLES.isdisjoint(role.id for role in interaction.user.roles)
 
 # --- DISCORD EVENTS ---
 @bot.event
@@ -150,15 +303,21 @@ async def containers(interaction: discord.Interaction):
     if not is_authorized(interaction):
         await interaction.response.send_message("❌ You don't have permission to do that.", ephemeral=True)
         return
+    await interaction.response.defer(ephemeral=True)
     try:
-        containers = get_containers()
+        containers = await get_containers()
         if not containers:
-            await interaction.response.send_message("No containers found.", ephemeral=True)
+            await interaction.followup.send("No containers found.", ephemeral=True)
             return
-        msg = "\n".join(f"**{name}** — {status}" for name, status in containers)
-        await interaction.response.send_message(f"📦 **Containers:**\n{msg}", ephemeral=True)
+        lines = [None] * (len(containers) + 1)
+        lines[0] = "📦 **Containers:**"
+        for i, (name, status) in enumerate(containers, 1):
+            lines[i] = f"**{name}** — {status}"
+        # 👇 split long listings so we never exceed Discord's message limit
+        for chunk in chunk_lines(lines):
+            await interaction.followup.send(chunk, ephemeral=True)
     except Exception as e:
-        await interaction.response.send_message(f"⚠️ Error: {e}", ephemeral=True)
+        await interaction.followup.send(f"⚠️ Error: {e}", ephemeral=True)
 
 @tree.command(name="restart", description="Restart a Docker container by name")
 @app_commands.describe(container="The name of the Docker container to restart")
@@ -173,9 +332,9 @@ async def restart(interaction: discord.Interaction, container: str):
     await interaction.response.defer(ephemeral=True)
 
     try:
-        nbspaces, gameline = call_external_script(container)   # may take time
-        run_docker_cmd(["restart", container])                 # may take time
-        send_webhook(interaction.user, container, "restart", nbspaces, gameline)
+        nbspaces, gameline = await call_external_script(container)   # may take time
+        await container_action(container, "restart")                # may take time
+        await send_webhook(interaction.user, container, "restart", nbspaces, gameline)
 
         # 👇 final follow-up message after long tasks finish
         await interaction.followup.send(
@@ -187,6 +346,8 @@ async def restart(interaction: discord.Interaction, container: str):
         await interaction.followup.send(
             f"⚠️ Error restarting `{container}`: {e}", ephemeral=True
         )
+    finally:
+        invalidate_container_cache()
 
 @tree.command(name="stop", description="Stop a Docker container by name")
 @app_commands.describe(container="The name of the Docker container to stop")
@@ -196,11 +357,13 @@ async def stop(interaction: discord.Interaction, container: str):
         return
     await interaction.response.defer(ephemeral=True)
     try:
-        run_docker_cmd(["stop", container])
-        send_webhook(interaction.user, container, "stop")
+        await container_action(container, "stop")
+        await send_webhook(interaction.user, container, "stop")
         await interaction.followup.send(f"🔴 Stopped `{container}` successfully.", ephemeral=True)
     except Exception as e:
         await interaction.followup.send(f"⚠️ Error stopping `{container}`: {e}", ephemeral=True)
+    finally:
+        invalidate_container_cache()
 
 @tree.command(name="start", description="Start a Docker container by name")
 @app_commands.describe(container="The name of the Docker container to start")
@@ -211,32 +374,35 @@ async def start(interaction: discord.Interaction, container: str):
     await interaction.response.defer(ephemeral=True)
     try:
         # ✅ Call the external rename script before starting
-        nbspaces, gameline = call_external_script(container)
-        run_docker_cmd(["start", container])
-        send_webhook(interaction.user, container, "start", nbspaces, gameline)
+        nbspaces, gameline = await call_external_script(container)
+        await container_action(container, "start")
+        await send_webhook(interaction.user, container, "start", nbspaces, gameline)
         await interaction.followup.send(f"🟢 Started `{container}` successfully.", ephemeral=True)
     except Exception as e:
         await interaction.followup.send(f"⚠️ Error starting `{container}`: {e}", ephemeral=True)
+    finally:
+        invalidate_container_cache()
 
 # --- AUTOCOMPLETE ---
-@restart.autocomplete("container")
-@stop.autocomplete("container")
-async def running_container_autocomplete(interaction: discord.Interaction, current: str):
-    containers = get_containers(only_running=True)
+def container_choices(containers, current):
+    """Return up to 25 choices whose name contains `current` (case-insensitive)."""
+    cur = current.casefold()
     choices = []
     for name, status in containers:
-        if current.lower() in name.lower():
+        if cur in name.casefold():
             choices.append(app_commands.Choice(name=f"{name} ({status})", value=name))
-    return choices[:25]
+            if len(choices) == 25:  # Discord's autocomplete limit
+                break
+    return choices
+
+@restart.autocomplete("container")
+@stop.autocomplete("container")
+async def running_container_autocomplete(interaction: discord.Interaction, current: str):
+    return container_choices(await get_containers(only_running=True), current)
 
 @start.autocomplete("container")
 async def stopped_container_autocomplete(interaction: discord.Interaction, current: str):
-    containers = get_containers(only_stopped=True)
-    choices = []
-    for name, status in containers:
-        if current.lower() in name.lower():
-            choices.append(app_commands.Choice(name=f"{name} ({status})", value=name))
-    return choices[:25]
+    return container_choices(await get_containers(only_stopped=True), current)
 
 # --- RUN BOT ---
 bot.run(TOKEN)